@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+
+# Author: Michael Falk
+
+import argparse
+from mmfparse.core import mmfParser
+from concurrent.futures import ThreadPoolExecutor
+
+def _parse(parser, inputtext, newdb):
+    """Creates the tables if requested, then imports the text file."""
+
+    # Create database
+    if newdb:
+        with parser._txn():
+            parser.create_tables()
+
+    # Import text
+    with parser._txn():
+        parser.import_records(inputtext)
+
+def _link(parser):
+    """Links editions to works, and holdings to libraries."""
+
+    # These touch separate tables, so they can run side by side on their
+    # own connections.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        phases = [
+            executor.submit(parser.link_books),
+            executor.submit(parser.update_libraries)
+        ]
+        for phase in phases:
+            phase.result()
+
+def run(inputtext, username, password, host, dbname, encoding, newdb, local_infile=False):
+    """Routine for importing data."""
+
+    # Initialise parser
+    parser = mmfParser(username, password, host, dbname, encoding, local_infile)
+
+    # Import the text, deduplicate works data, then find links in data
+    try:
+        _parse(parser, inputtext, newdb)
+        parser.deduplicate_books()
+        _link(parser)
+    finally:
+        parser.close()
+
+# Handlers for each subcommand. Each takes the parsed arguments.
+
+def _import_cmd(args):
+    run(args.inputtext, args.username, args.password, args.host, args.dbname,
+        args.encoding, args.newdb, args.local_infile)
+
+def _parse_cmd(args):
+    parser = mmfParser(args.username, args.password, args.host, args.dbname,
+                       args.encoding, args.local_infile)
+    try:
+        _parse(parser, args.inputtext, args.newdb)
+    finally:
+        parser.close()
+
+def _dedup_cmd(args):
+    parser = mmfParser(args.username, args.password, args.host, args.dbname, args.encoding)
+    try:
+        parser.deduplicate_books()
+    finally:
+        parser.close()
+
+def _link_cmd(args):
+    parser = mmfParser(args.username, args.password, args.host, args.dbname, args.encoding)
+    try:
+        _link(parser)
+    finally:
+        parser.close()
+
+def _build_parser():
+    """Builds the command line argument parser."""
+
+    # Arguments shared by every subcommand
+    database = argparse.ArgumentParser(add_help=False)
+    database.add_argument("-db", "--database-name", help="The name of the MySQL database where the output is to be saved.", dest="dbname")
+    database.add_argument("-u", "--username", help="Your username for the database.")
+    database.add_argument("-p", "--password", help="Your password for the database")
+    database.add_argument("-hst", "--host", default="127.0.0.1", help="The IP address of the database. Defaults to localhost.")
+    database.add_argument("-e", "--encoding", default="cp1252", help="The encoding of the text file from Notebook. Defaults to windows-1252.")
+
+    # Arguments for subcommands that read a text file
+    text = argparse.ArgumentParser(add_help=False)
+    text.add_argument("-i", "--input-text", help="The raw text file you wish to convert.", dest="inputtext")
+    text.add_argument("-n", "--new-db", action="store_true", help="Set this flag if you want to create a new database or overwrite an existing one.", dest="newdb")
+    text.add_argument("-l", "--local-infile", action="store_true", help="Bulk load records with LOAD DATA LOCAL INFILE. The server must allow local_infile.", dest="local_infile")
+
+    # Instantiate parser. Arguments can also be read from a file: @args.txt
+    parser = argparse.ArgumentParser(
+        description="Convert raw output from the Notebook MMF database into well-formed MySQL.",
+        fromfile_prefix_chars="@")
+    subparsers = parser.add_subparsers(dest="cmd", required=True)
+
+    # Subcommands
+    sp = subparsers.add_parser("import", parents=[database, text], help="Run the whole import: parse, dedup and link.")
+    sp.set_defaults(func=_import_cmd)
+    sp = subparsers.add_parser("parse", parents=[database, text], help="Import the text file without deduplicating or linking.")
+    sp.set_defaults(func=_parse_cmd)
+    sp = subparsers.add_parser("dedup", parents=[database], help="Merge duplicate works.")
+    sp.set_defaults(func=_dedup_cmd)
+    sp = subparsers.add_parser("link", parents=[database], help="Link editions to works and holdings to libraries.")
+    sp.set_defaults(func=_link_cmd)
+
+    return parser
+
+# The parser is built once, when the module is imported
+_PARSER = _build_parser()
+
+def main(argv=None):
+    """Parses arguments and runs the chosen subcommand."""
+
+    args = _PARSER.parse_args(argv)
+    args.func(args)
+
+if __name__=="__main__":
+    main()
@@ -1,10 +1,67 @@
-import mysql.connector
-from uuid import uuid4
+from mysql.connector.constants import ClientFlag
+from mysql.connector.pooling import MySQLConnectionPool
+import os
+import mmap
+from tempfile import NamedTemporaryFile
 import re
 from tqdm import tqdm
 from datetime import date
+from itertools import count, islice
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 
-from .util import DupeDict, ErrorDict
+from .util import DupeDict, ErrorDict, confirm, tsv_field
+
+# Regexes for processing each record as a string.
+# Each regex relies on the prior application of the one before.
+
+# Regex for stripping out extraneous dollar signs (group 1) and newlines,
+# in one pass. A dollar sign is extraneous before a new field or at the end.
+_CLEAN_RE = re.compile(r'(\$\s?(?=\n%|\Z))|\n(?!%)')
+# Regex for pulling out keys and values
+_KV_RE = re.compile(r'<?(\d{1,2}|Incipit)>?:(.+?)\s*(?:\n|$)')
+# Regex for removing null entries
+_NE_RE = re.compile(r'^<\d{1,2}>$|^\$?[\s\n]+$')
+
+# Regexes for processing the fields of each record.
+
+# Regex for extracting page numbers from references. The group makes
+# split() return the page numbers between the other parts of the reference.
+_PAGES_RE = re.compile(r'\b(\d+)\b')
+
+# Regex for checking signature of identifiers
+_WRK_ID_RE = re.compile(r'^(?:\d{2}\w{2}|s\.d\.)\.[A-Z ]{3}\.[a-z\d]{3}\b')
+_ED_ID_RE = re.compile(r'^.{12} (?:\d{2}\w{2}|s\.d\.)\.[A-Z ]{3}\.[a-z\d]{3}\b')
+
+# Regex for splitting titles
+_TITLE_RE = re.compile(r'Z[12]')
+
+# Regex for finding deleted or hidden entries
+_HIDDEN_RE = re.compile(r'(\bz+\b|ENTERED|x+(?<!\b\d{2}))', re.I)
+
+# Regex for extracting library names from holdings
+# It looks for a word consisting of a name (which may contain
+# hyphens), followed by a hyphen and 1-5 capitals
+_HOLDING_RE = re.compile(r'\b[\w\-]+-[A-Z]{1,5}\b')
+
+def _clean_repl(match):
+    """Drops extraneous dollar signs, and turns extraneous newlines into spaces."""
+    return '' if match.group(1) else ' '
+
+def _parse_record(raw, encoding):
+    """Decodes a raw record and extracts its fields into a dict, keyed by code.
+    
+    Defined at module level so that it can run in worker processes."""
+    record = mmfParser._decode_record(raw, encoding)
+    record = _CLEAN_RE.sub(_clean_repl, record)  # dollarsigns and newlines
+    record = dict(_KV_RE.findall(record))  # information
+    return {k:v.strip() for k,v in record.items() if not _NE_RE.match(v)} # null entries
+
+def _parse_batch(raws, encoding):
+    """Parses a batch of raw records in a worker process."""
+    return [_parse_record(raw, encoding) for raw in raws]
 
 class mmfParser(object):
     """Main class for parsing MMF output files.
@@ -20,6 +77,7 @@ class mmfParser(object):
     host (str): IP address of database
     dbname (str): the name of the database
     encoding (str): the encoding of the input MMF text file
+    local_infile (bool): bulk load with LOAD DATA LOCAL INFILE instead of INSERT
     """
 
     # Constants: field codes of the original MMF database
@@ -100,13 +158,31 @@ class mmfParser(object):
         "##":"\n"
     }
 
+    # ASCII_CODES compiled for a single pass over the text: one-character
+    # codes go through str.translate, and the rest are matched by one regex,
+    # longest first so that e.g. '/sic==/' wins over '/=='
+    _ASCII_TRANS = str.maketrans({k: v for k, v in ASCII_CODES.items() if len(k) == 1})
+    _ASCII_RE = re.compile('|'.join(
+        re.escape(k) for k in sorted(ASCII_CODES, key=len, reverse=True) if len(k) > 1))
+    # Replacement for each _ASCII_RE match, with the dict lookup bound once
+    _ASCII_REPL = staticmethod(
+        lambda match, get=ASCII_CODES.__getitem__: get(match[0]))
+
+    # Empty editions and works, copied for each record
+    _EDITION_TEMPLATE = dict.fromkeys(EDITION_CODES.values())
+    _WORK_TEMPLATE = dict.fromkeys(WORK_CODES.values())
+
+    # Marker at the end of each record in a Notebook output file, with any
+    # line ending: Windows, Unix or old Mac
+    _END_RE = re.compile(rb'(?:\r\n|\r|\n)%End:(?:\r\n|\r|\n)')
+
     # Constant: sql schema of new MMF database
     SCHEMA = {
         # Each 'princeps' is represented by a work
         'mmf_work': """
         CREATE TABLE IF NOT EXISTS mmf_work (
-            work_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-            uuid CHAR(36) NOT NULL,
+            work_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            uuid BINARY(16) NOT NULL,
             work_identifier CHAR(12),
             translation VARCHAR(128),
             title TEXT,
@@ -116,15 +192,16 @@ class mmfParser(object):
             original_title TEXT,
             translation_comments TEXT,
             description TEXT,
-            incipit TEXT
+            incipit TEXT,
+            UNIQUE KEY work_work_identifier (work_identifier)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """,
         # Each 're-edition' is represented by an edition
         'mmf_edition': """
         CREATE TABLE IF NOT EXISTS mmf_edition (
-            edition_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-            work_id INT,
-            uuid CHAR(36) NOT NULL,
+            edition_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            work_id INT UNSIGNED,
+            uuid BINARY(16) NOT NULL,
             work_identifier CHAR(12),
             ed_identifier CHAR(12),
             edition_counter CHAR(7),
@@ -143,45 +220,46 @@ class mmfParser(object):
         # Each library copy is represented by a holding
         'mmf_holding': """
         CREATE TABLE IF NOT EXISTS mmf_holding (
-            holding_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-            edition_id INT NOT NULL,
+            holding_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            edition_id INT UNSIGNED NOT NULL,
             lib_name VARCHAR(255),
-            lib_id INT
+            lib_id INT UNSIGNED
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """,
         # Each library is represented by a library
         'mmf_lib': """
         CREATE TABLE IF NOT EXISTS mmf_lib (
-            lib_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            lib_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
             short_name VARCHAR(255),
-            full_name TEXT
+            full_name VARCHAR(512),
+            UNIQUE KEY lib_short_name (short_name)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """,
         # Each reference is respresented as a reference
         'mmf_ref': """
         CREATE TABLE IF NOT EXISTS mmf_ref (
-            ref_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-            work_id INT NOT NULL,
+            ref_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            work_id INT UNSIGNED NOT NULL,
             short_name VARCHAR(255),
-            page_num INT,
-            ref_work INT,
-            ref_type INT NOT NULL
+            page_num INT UNSIGNED,
+            ref_work INT UNSIGNED,
+            ref_type TINYINT UNSIGNED NOT NULL
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """,
         # Each reference is of one of two types
         'mmf_ref_type': """
         CREATE TABLE IF NOT EXISTS mmf_ref_type (
-            ref_type_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(255)
+            ref_type_id TINYINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(32)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8
         """,
         # Table for recording errors
         'mmf_error': """
         CREATE TABLE IF NOT EXISTS mmf_error (
-            error_id INT AUTO_INCREMENT PRIMARY KEY,
+            error_id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
             filename VARCHAR(255),
-            edition_id INT,
-            work_id INT,
+            edition_id INT UNSIGNED,
+            work_id INT UNSIGNED,
             text TEXT,
             error_note VARCHAR(255),
             date DATE
@@ -189,13 +267,14 @@ class mmfParser(object):
         """
     }
 
-    # Combined list of indexes that can be deleted and rebuilt as required
+    # The whole schema as one script, so it can be sent in a single round-trip
+    _DDL_SCRIPT = ';\n'.join(
+        f'DROP TABLE IF EXISTS {table};\n{stmt}' for table, stmt in SCHEMA.items())
+
+    # Combined list of indexes that can be deleted and rebuilt as required.
+    # The unique keys on mmf_work and mmf_lib are kept, as they merge
+    # duplicate works and libraries.
     INDEXES = [
-        {
-            'table': 'mmf_work',
-            'name': 'work_work_identifier',
-            'column': 'work_identifier'
-        },
         {
             'table': 'mmf_edition',
             'name': 'edition_work_identifier',
@@ -210,15 +289,80 @@ class mmfParser(object):
             'table': 'mmf_holding',
             'name': 'holding_lib_name',
             'column': 'lib_name'
-        },
-        {
-            'table': 'mmf_lib',
-            'name': 'lib_lib_name',
-            'column': 'short_name'
         }
     ]
 
-    def __init__(self, username, password, host, dbname, encoding):
+    # Number of rows buffered per table before they are written to the database
+    BATCH_SIZE = 200
+
+    # Columns written by the importer for each table, in insert order
+    COLUMNS = {
+        'mmf_work': (
+            'work_id', 'uuid', 'work_identifier', 'translation', 'title',
+            'comments', 'bur_references', 'bur_comments', 'original_title',
+            'translation_comments', 'description', 'incipit'
+        ),
+        'mmf_edition': (
+            'edition_id', 'work_id', 'uuid', 'work_identifier', 'ed_identifier',
+            'edition_counter', 'translation', 'author', 'translator',
+            'short_title', 'long_title', 'collection_title',
+            'publication_details', 'comments', 'final_comments'
+        ),
+        'mmf_holding': ('edition_id', 'lib_name'),
+        'mmf_ref': ('work_id', 'short_name', 'page_num', 'ref_type'),
+        'mmf_error': (
+            'filename', 'edition_id', 'work_id', 'text', 'error_note', 'date'
+        )
+    }
+
+    # Number of connections held open to the database
+    POOL_SIZE = 8
+
+    # Number of parallel workers for each linking phase. Two phases may run
+    # at once alongside the import connection, so 2 * SHARDS + 1 must not
+    # exceed POOL_SIZE.
+    SHARDS = 3
+
+    # Number of rows buffered per table when bulk loading from a file
+    LOAD_BATCH_SIZE = 20000
+
+    # Number of worker processes parsing records (None for one per CPU),
+    # and number of records sent to a worker at a time
+    WORKERS = None
+    PARSE_CHUNK_SIZE = 256
+
+    # Insert statements, one per table in COLUMNS, completed by _insert_stmt
+    # with one group of placeholders per row
+    INSERTS = {
+        table: 'INSERT INTO {} ({}) VALUES '.format(table, ', '.join(cols))
+        for table, cols in COLUMNS.items()
+    }
+    ROWS = {
+        table: '({})'.format(', '.join(['%s'] * len(cols)))
+        for table, cols in COLUMNS.items()
+    }
+
+    # A work whose identifier is already in the database is merged into the
+    # existing row, filling in any fields that are still empty
+    UPSERTS = {
+        'mmf_work': ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+            f'{col} = COALESCE({col}, VALUES({col}))'
+            for col in COLUMNS['mmf_work'] if col not in ('work_id', 'uuid', 'work_identifier'))
+    }
+
+    # Bulk load statements, one per table in COLUMNS. Works are left out, as
+    # LOAD DATA cannot merge duplicates.
+    LOADS = {
+        table: "LOAD DATA LOCAL INFILE %s INTO TABLE {} CHARACTER SET utf8 "
+            "FIELDS TERMINATED BY '\\t' ENCLOSED BY '' ESCAPED BY '\\\\' "
+            "LINES TERMINATED BY '\\n' ({}){}".format(
+                table,
+                ', '.join('@uuid' if col == 'uuid' else col for col in cols),
+                ' SET uuid = UNHEX(@uuid)' if 'uuid' in cols else '')
+        for table, cols in COLUMNS.items() if table != 'mmf_work'
+    }
+
+    def __init__(self, username, password, host, dbname, encoding, local_infile=False):
         
         # Store arguments
         self.username = username
@@ -226,36 +370,177 @@ class mmfParser(object):
         self.host = host
         self.dbname = dbname
         self.encoding = encoding
-
-        # Connect to MySQL database
-        self.conn = mysql.connector.connect(
+        self.local_infile = local_infile
+
+        # Connect to MySQL database through a pool, so that independent
+        # phases can each borrow a connection of their own. Autocommit is off,
+        # so the import is written as one transaction and InnoDB flushes its
+        # log once, at the final commit; a row that fails rolls the whole
+        # import back. The pool resets each connection's session when it is
+        # returned.
+        self.pool = MySQLConnectionPool(
+            pool_name='mmf',
+            pool_size=self.POOL_SIZE,
             user=username,
             password=password,
             host=host,
             database=dbname,
-            use_unicode = True
+            use_unicode = True,
+            use_pure = False, # Let the C extension pack parameters
+            allow_local_infile = local_infile,
+            client_flags = [ClientFlag.LOCAL_FILES] if local_infile else [],
+            autocommit = False
             )
+        self.conn = self.pool.get_connection()
+
+        # Rows waiting to be written, keyed by table
+        self._pending = {table: [] for table in self.COLUMNS}
+
+        # Server-side prepared cursors and their statements, keyed by table
+        # and number of rows, so that each batch size is only prepared once
+        self._prepared = {}
+        self._stmts = {}
         
         # Alert user
         print(f'Connected to database {dbname} on {host} as {username}.')
 
+    def close(self):
+        """Returns the import connection to the pool."""
+        self.conn.close()
+        print(f'Disconnected from database {self.dbname}.')
+
+    @contextmanager
+    def _txn(self):
+        """Context manager that runs the enclosed statements as one transaction.
+        
+        Commits when the block exits normally, and rolls back if it raises."""
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+
+    @contextmanager
+    def _conn(self):
+        """Context manager that borrows a connection from the pool.
+        
+        The enclosed statements run as one transaction, and the connection
+        is returned to the pool afterwards."""
+        conn = self.pool.get_connection()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _uuid_batch(self, n):
+        """Generates n random UUIDs as 16-byte strings with one call to os.urandom."""
+        buf = bytearray(os.urandom(16 * n))
+        # Set the version 4 and variant bits (RFC 4122)
+        buf[6::16] = bytes(b & 0x0F | 0x40 for b in buf[6::16])
+        buf[8::16] = bytes(b & 0x3F | 0x80 for b in buf[8::16])
+        return [bytes(buf[i:i+16]) for i in range(0, len(buf), 16)]
+
+    def _uuids(self):
+        """Yields random UUIDs, drawing them from the OS a batch at a time."""
+        while True:
+            yield from self._uuid_batch(self.BATCH_SIZE)
+
+    def _enqueue(self, table, row):
+        """Buffers a row for insertion, writing out the batch once it is full.
+        
+        Arguments:
+        ==========
+        table (str): the name of the table
+        row (dict): the values to insert, keyed by column name
+        """
+        pending = self._pending[table]
+        pending.append(tuple(row[col] for col in self.COLUMNS[table]))
+        if self.local_infile and table in self.LOADS:
+            batch_size = self.LOAD_BATCH_SIZE
+        else:
+            batch_size = self.BATCH_SIZE
+        if len(pending) >= batch_size:
+            self._flush_table(table)
+
+    def _flush_table(self, table):
+        """Writes the buffered rows for one table in a single statement.
+        
+        Rows are sent as a multi-row INSERT through a server-side prepared
+        statement, or streamed from a temporary tab-separated file with LOAD
+        DATA LOCAL INFILE if bulk loading is on. Nothing is committed here:
+        the rows join the import transaction, which flush() commits."""
+        pending = self._pending[table]
+        if len(pending) == 0:
+            return
+        if self.local_infile and table in self.LOADS:
+            self._load_data(table, pending)
+        else:
+            if table not in self._prepared:
+                self._prepared[table] = self.conn.cursor(prepared=True)
+            self._prepared[table].execute(
+                self._insert_stmt(table, len(pending)),
+                [val for row in pending for val in row])
+        pending.clear()
+
+    def _insert_stmt(self, table, n):
+        """Returns the INSERT statement for n rows of a table.
+        
+        Statements are cached, so that the prepared cursor sees the same
+        statement for every full batch and does not prepare it again."""
+        key = (table, n)
+        if key not in self._stmts:
+            self._stmts[key] = (self.INSERTS[table]
+                + ', '.join([self.ROWS[table]] * n)
+                + self.UPSERTS.get(table, ''))
+        return self._stmts[key]
+
+    def _close_prepared(self):
+        """Closes the prepared cursors, deallocating their statements on the server."""
+        for cur in self._prepared.values():
+            cur.close()
+        self._prepared.clear()
+
+    def _load_data(self, table, rows):
+        """Writes rows to a temporary TSV file and bulk loads it into the table."""
+        with NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.tsv', delete=False) as f:
+            for row in rows:
+                f.write('\t'.join(tsv_field(val) for val in row) + '\n')
+        try:
+            self.cur.execute(self.LOADS[table], (f.name,))
+        finally:
+            os.remove(f.name)
+
+    def flush(self):
+        """Writes all buffered rows to the database and commits the import."""
+        for table in self._pending:
+            self._flush_table(table)
+        self.conn.commit()
+
     def create_tables(self):
         """Creates essential tables for the MMF database."""
         
         # Do any of the tables exist?
         self.cur = self.conn.cursor()
-        self.cur.execute('SHOW TABLES')
-        table_list = self.cur.fetchall()
-        table_list = [tbl for (tbl,) in table_list if tbl in self.SCHEMA.keys()]
+        placeholders = ', '.join(['%s'] * len(self.SCHEMA))
+        self.cur.execute(f"""
+        SELECT table_name FROM information_schema.tables
+            WHERE table_schema = %s AND table_name IN ({placeholders})
+        """, (self.dbname, *self.SCHEMA))
+        table_list = [tbl for (tbl,) in self.cur.fetchall()]
 
         # Inner function for creating table
         def _apply_schema():
-            for table, stmt in self.SCHEMA.items():
-                # Can't use params because it wraps strings in quotation marks
-                self.cur.execute('DROP TABLE IF EXISTS %s' % table)
-                self.cur.execute(stmt)
-                self.conn.commit()
-                print(f'Table {table} created in database {self.dbname}.')
+            # DDL commits implicitly, so there is nothing to commit here
+            for result in self.cur.execute(self._DDL_SCRIPT, multi=True):
+                if result.with_rows:
+                    result.fetchall()
+            print(f'Tables {", ".join(self.SCHEMA)} created in database {self.dbname}.')
             # Insert values into mmf_ref_type
             self.cur.execute("""
             INSERT INTO mmf_ref_type VALUES
@@ -268,10 +553,8 @@ class mmfParser(object):
         # Allow user input, apply the schema
         if len(table_list) > 0:
             print(f'Tables {", ".join(table_list)} already exist.')
-            usr_choice = input('Overwrite? y/n\n')
-            if usr_choice.startswith('y'):
-                confirmation = input('This will overwrite existing tables, are you sure? y/n\n')
-                if confirmation.startswith('y'):
+            if confirm('Overwrite? y/n\n'):
+                if confirm('This will overwrite existing tables, are you sure? y/n\n'):
                     _apply_schema()
                     self.cur.close()
                 else:
@@ -288,151 +571,151 @@ class mmfParser(object):
 
         return True
 
-    def import_records(self, inputtext):
-        """Imports records from a Notebook output file into the MMF database."""
-
-        # Read the text file into memory
-        with open(inputtext, 'r', encoding=self.encoding, errors='ignore') as f:
-            # There are some non-ASCII characters that have crept in to notes
-            # copied and pasted from the web, so errors must be set to 'ignore'
-            text = f.read()
-
-        # Process using ASCII table
-        for old, new in self.ASCII_CODES.items():
-            text = text.replace(old, new)
-        
-        # Split
-        text = text.split("\n%End:\n")
+    def _iter_records(self, inputtext):
+        """Yields the raw records of a Notebook output file one at a time.
         
-        # Define regexes for processing each record as a string.
-        # Each regex relies on the prior application of the one before.
-
-        # Regex for stripping out extraneous newlines
-        nl = re.compile(r'\n(?!%)')
-        # Regex for stripping out extraneous dollar signs
-        ds = re.compile(r'\$\s?(?=\n+|$)')
-        # Regex for pulling out keys and values
-        kv = re.compile(r'<?(\d{1,2}|Incipit)>?:(.+?)\s*(?:\n|$)')
-        # Regex for removing null entries
-        ne = re.compile(r'^<\d{1,2}>$|^\$?[\s\n]+$')
-
-        # Regex for extracting page numbers from references
-        pages_rgx = re.compile(r'\b\d+\b')
-
-        # Regex for checking signature of identifiers
-        wrk_id_rgx = re.compile(r'^(?:\d{2}\w{2}|s\.d\.)\.[A-Z ]{3}\.[a-z\d]{3}\b')
-        ed_id_rgx = re.compile(r'^.{12} (?:\d{2}\w{2}|s\.d\.)\.[A-Z ]{3}\.[a-z\d]{3}\b')
+        The file is memory-mapped rather than read, and records are yielded
+        as bytes, to be decoded by _parse_record. As the file is split before
+        it is decoded, the encoding must be ASCII-compatible (e.g. cp1252 or
+        utf-8): UTF-16 input, for example, cannot be split this way."""
+
+        with open(inputtext, 'rb') as f:
+            # Empty files cannot be mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                for marker in self._END_RE.finditer(mm):
+                    yield mm[start:marker.start()]
+                    start = marker.end()
+                # Anything after the last %End: marker
+                if mm[start:].strip():
+                    yield mm[start:]
+
+    def _parse_records(self, inputtext):
+        """Yields the records of a Notebook output file as dicts of fields.
         
-        # Regex for splitting titles
-        title_rgx = re.compile(r'Z[12]')
+        Records are independent, so they are decoded and split into fields
+        by a pool of worker processes, and yielded in file order. Only a few
+        batches per worker are in flight at once, so that the file is still
+        streamed rather than read into memory ahead of the import."""
+        records = self._iter_records(inputtext)
+        parse = partial(_parse_batch, encoding=self.encoding)
+        window = 2 * (self.WORKERS or os.cpu_count() or 1)
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.WORKERS) as pool:
+            for batch in iter(lambda: list(islice(records, self.PARSE_CHUNK_SIZE)), []):
+                pending.append(pool.submit(parse, batch))
+                if len(pending) >= window:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    @classmethod
+    def _decode_record(cls, raw, encoding):
+        """Decodes a raw record and converts its ASCII codes."""
+
+        # There are some non-ASCII characters that have crept in to notes
+        # copied and pasted from the web, so errors must be set to 'ignore'
+        text = raw.decode(encoding, errors='ignore')
+        # Normalise line endings, as reading in text mode would
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+        # Process using ASCII table
+        text = text.translate(cls._ASCII_TRANS)
+        return cls._ASCII_RE.sub(cls._ASCII_REPL, text)
 
-        # Regex for finding deleted or hidden entries
-        hidden_rgx = re.compile(r'(\bz+\b|ENTERED|x+(?<!\b\d{2}))', re.I)
+    def _alter_indexes(self, clause, options=None):
+        """Applies a clause to every index in INDEXES, with one ALTER TABLE per table.
+        
+        Arguments:
+        ==========
+        clause (str): format string for each index, e.g. 'DROP INDEX {name}'
+        options (str): table options appended to each statement, if any
+        """
+        tables = {}
+        for idx_dict in self.INDEXES:
+            tables.setdefault(idx_dict['table'], []).append(clause.format(**idx_dict))
+        for table, clauses in tables.items():
+            if options is not None:
+                clauses.append(options)
+            self.cur.execute(f"ALTER TABLE {table} {', '.join(clauses)}")
 
-        # Regex for extracting library names from holdings
-        # It looks for a word consisting of a name (which may contain
-        # hyphens), followed by a hyphen and 1-5 capitals
-        holding_rgx = re.compile(r'\b[\w\-]+-[A-Z]{1,5}\b')
+    def import_records(self, inputtext):
+        """Imports records from a Notebook output file into the MMF database."""
 
-        # Initialise a cursor and define input sql
+        # Initialise a cursor
         self.cur = self.conn.cursor()
-        insert_work = """
-        INSERT INTO mmf_work VALUES (NULL,
-            %(uuid)s, %(work_identifier)s, %(translation)s,
-            %(title)s, %(comments)s, %(bur_references)s, %(bur_comments)s,
-            %(original_title)s, %(translation_comments)s,
-            %(description)s, %(incipit)s
-        )
-        """
-        insert_edition = """
-        INSERT INTO mmf_edition VALUES (NULL, %(work_id)s,
-            %(uuid)s, %(work_identifier)s, %(ed_identifier)s,
-            %(edition_counter)s, %(translation)s,
-            %(author)s, %(translator)s, %(short_title)s, %(long_title)s,
-            %(collection_title)s, %(publication_details)s,
-            %(comments)s, %(final_comments)s, NULL
-        )
-        """
-        insert_holdings = """
-        INSERT INTO mmf_holding VALUES (NULL, %s, %s, NULL)
-        """
-        insert_error = """
-        INSERT INTO mmf_error VALUES (
-            NULL, %(filename)s, %(edition_id)s,
-            %(work_id)s, %(text)s, %(error_note)s, %(date)s
-            )
-        """
-        insert_references = """
-        INSERT INTO mmf_ref VALUES (
-            NULL, %(work_id)s, %(short_name)s, %(page_num)s, NULL, %(ref_type)s
-            )
-        """
 
-        # Error logging function
+        # Error logging function. The error dict is queued as a row straight
+        # away, so it can be reset then rather than for every record.
         def _log_error(**kwargs):
             err.update(**kwargs)
-            self.cur.execute(insert_error, err)
-            self.conn.commit()
+            self._enqueue('mmf_error', err)
+            err.reset()
 
         # Drop the indices on the identifier columns
-        for idx_dict in self.INDEXES:
-            self.cur.execute("DROP INDEX IF EXISTS {name} ON {table}".format(**idx_dict))
+        self._alter_indexes('DROP INDEX IF EXISTS {name}')
         self.conn.commit()
 
+        # Primary keys are assigned here rather than by AUTO_INCREMENT, so that
+        # editions, holdings and references can be batched with their parents
+        self.cur.execute("SELECT COALESCE(MAX(work_id), 0) FROM mmf_work")
+        work_ids = count(self.cur.fetchone()[0] + 1)
+        # Works already in the database keep their ids, so that duplicates
+        # are merged into them on insert
+        self.cur.execute("SELECT work_identifier, work_id FROM mmf_work")
+        known_works = dict(self.cur.fetchall())
+        self.cur.execute("SELECT COALESCE(MAX(edition_id), 0) FROM mmf_edition")
+        edition_ids = count(self.cur.fetchone()[0] + 1)
+
         print("Processing records...")
+        uuids = self._uuids() # Source of uuids for new rows
         err = ErrorDict(inputtext) # Initialise ErrorDict
         successes = 0 # Count successful writes to databse
         errors = 0 # Count errors during import
-        pbar = tqdm(total = len(text)) # Initialise progress bar
+        unused_codes = set() # Codes left over in a record, cleared once logged
+
+        # Bind lookups used for every record
+        hidden_search = _HIDDEN_RE.search
+        wrk_id_findall = _WRK_ID_RE.findall
+        ed_id_findall = _ED_ID_RE.findall
+        enqueue = self._enqueue
+        edition_codes = tuple(self.EDITION_CODES.items())
+        work_codes = tuple(self.WORK_CODES.items())
+        edition_template = self._EDITION_TEMPLATE
+        work_template = self._WORK_TEMPLATE
+
+        # Fields of the other record type's codes that fit an edition or a
+        # work, for hoovering up information stored in the wrong fields.
+        # Each code maps to a different field, so the order they are
+        # hoovered up in does not matter.
+        edition_hoover = {code: field for code, field in work_codes
+            if code not in self.EDITION_CODES and field in edition_template}
+        work_hoover = {code: field for code, field in edition_codes
+            if code not in self.WORK_CODES}
 
         # Iterate over the records:
-        while len(text) > 0:
-
-            # Get next record
-            record = text.pop()
-            # Reset error dict
-            err.reset()
-            unused_codes = set()
-
-            # Extract record into dict
-            record = nl.sub(" ", record)  # newlines
-            record = ds.sub("", record)  # dollarsigns
-            record = dict(kv.findall(record))  # information
-            record = {k:v.strip() for k,v in record.items() if not ne.match(v)} # null entries
+        for record in tqdm(self._parse_records(inputtext), unit=' records'):
 
             # Extract key info from full identifier
-            if '0' not in record:
-                err.update(
+            full_identifier = record.get('0')
+            if full_identifier is None:
+                _log_error(
                     text = str(record),
                     error_note = "No identifier")
-                self.cur.execute(insert_error, err)
-                self.conn.commit()
                 errors += 1
-                pbar.update(1)
-                continue
-            
-            if hidden_rgx.search(record['0']):
-                _log_error(
-                    text=str(record),
-                    error_note="Hidden or deleted"
-                    )
-                pbar.update(1)
                 continue
             
-            if '4' in record and record['4'].startswith('xx'):
+            # Hidden or deleted entries are marked in the translation field,
+            # or in the identifier. The cheap tests go first.
+            if (record.get('4', '')[:2] == 'xx'
+                    or record.get('04', '')[:2] == 'xx'
+                    or hidden_search(full_identifier)):
                 _log_error(
                     text=str(record),
                     error_note="Hidden or deleted"
                 )
-                pbar.update(1)
-                continue
-            
-            if '04' in record and record['04'].startswith('xx'):
-                _log_error(
-                    text=str(record),
-                    error_note="Hidden or deleted"
-                )
-                pbar.update(1)
                 continue
             
             if '1' not in record and '01' not in record:
@@ -440,34 +723,34 @@ class mmfParser(object):
                     text = str(record),
                     error_note = "Incomplete identifiers"
                 )
-                pbar.update(1)
                 continue
 
-            work_identifier = wrk_id_rgx.findall(record['0'])
-            ed_identifier = ed_id_rgx.findall(record['0'])
+            work_identifier = wrk_id_findall(full_identifier)
+            ed_identifier = ed_id_findall(full_identifier)
 
             # Editions have both edition and work identifiers
             if len(ed_identifier) > 0 and len(work_identifier) > 0:
                 # Create new dict for the edition
-                ed = {}.fromkeys(self.EDITION_CODES.values())
+                ed = edition_template.copy()
 
                 # Set uuid, edition id, get work identifier
-                ed['uuid'] = str(uuid4())
+                ed['uuid'] = next(uuids)
+                ed['edition_id'] = edition_id = next(edition_ids)
                 ed['work_id'] = None # This is unknown for re-editions
 
                 # Loop through the field definitions for editions,
                 # and extract the key information
-                for code, field in self.EDITION_CODES.items():
+                for code, field in edition_codes:
                     if code in record:
                         ed[field] = record[code]
                 
                 # Hoover up any information stored in the wrong fields
-                for code, field in self.WORK_CODES.items():
-                    if code not in self.EDITION_CODES and field in ed and code in record:
-                        if ed[field] is None:
-                            ed[field] = record[code]
-                        elif ed[field] is not None:
-                            unused_codes.add(code)
+                for code in record.keys() & edition_hoover.keys():
+                    field = edition_hoover[code]
+                    if ed[field] is None:
+                        ed[field] = record[code]
+                    elif ed[field] is not None:
+                        unused_codes.add(code)
                 
                 # If work_identifier has not been provided, include it now
                 ed['work_identifier'] = work_identifier[0]
@@ -480,28 +763,24 @@ class mmfParser(object):
                 if ed['edition_counter'] is not None:
                     ed['edition_counter'] = ed['edition_counter'][0:7]
 
-                # Concatenate two halves of title
-                if ed['long_title'] is not None and ed['short_title'] is not None:
-                    ed['long_title'] = ed['short_title'] + ed['long_title']
-                
-                # Sometimes the long title is in field 21, with a Z1 or Z2 seperating the two components
-                if ed['short_title'] is not None and title_rgx.search(ed['short_title']):
-                    segs = title_rgx.split(ed['short_title'])
-                    ed['long_title'] = segs[0] + segs[1]
-                    ed['short_title'] = segs[0]
-
-                # Insert into DB
-                self.cur.execute(insert_edition, ed)
-                self.conn.commit()
-
-                # Get new primary key
-                self.cur.execute("SELECT LAST_INSERT_ID()")
-                edition_id = self.cur.fetchone()[0]
-
-                # Explode holdings and insert them
+                short_title = ed['short_title']
+                if short_title is not None:
+                    segs = _TITLE_RE.split(short_title)
+                    # Sometimes the long title is in field 21, with a Z1 or Z2 seperating the two components
+                    if len(segs) > 1:
+                        ed['long_title'] = segs[0] + segs[1]
+                        ed['short_title'] = segs[0]
+                    # Otherwise concatenate two halves of title
+                    elif ed['long_title'] is not None:
+                        ed['long_title'] = short_title + ed['long_title']
+
+                # Queue for insertion
+                enqueue('mmf_edition', ed)
+
+                # Explode holdings and queue them
                 if ed['holdings'] is not None:
                     # Extract holdings using regex
-                    holdings = holding_rgx.findall(ed['holdings'])
+                    holdings = _HOLDING_RE.findall(ed['holdings'])
                     # If none are extracted, log an error
                     if len(holdings) == 0:
                         _log_error(
@@ -509,22 +788,19 @@ class mmfParser(object):
                             error_note = "Junk holdings",
                             edition_id = edition_id)
                     else:
-                        # Create parameter sequence
-                        param_seq = [(edition_id, lib) for lib in holdings]
-                        # Insert the holdings
-                        self.cur.executemany(insert_holdings, param_seq)
-                        self.conn.commit()
+                        for lib in holdings:
+                            enqueue('mmf_holding', {'edition_id':edition_id, 'lib_name':lib})
                 
                 successes += 1
 
             # The princeps has no edition identifier
             elif len(work_identifier) > 0:
                 # Works in MMF2 need to be split into works and editions
-                wk = {}.fromkeys(self.WORK_CODES.values())
-                ed = {}.fromkeys(self.EDITION_CODES.values())
+                wk = work_template.copy()
+                ed = edition_template.copy()
 
                 # Extract data:
-                for code, field in self.WORK_CODES.items():
+                for code, field in work_codes:
                     if code in record:
                         wk[field] = record[code]
                 
@@ -534,18 +810,22 @@ class mmfParser(object):
                         ed[k] = v
                 
                 # Hoover up any remaining info
-                for code,field in self.EDITION_CODES.items():
-                    if code not in self.WORK_CODES and code in record:
-                        if field in wk and wk[field] is None:
-                            wk[field] = record[code]
-                        if field in ed and ed[field] is None:
-                            ed[field] = record[code]
-                        else:
-                            unused_codes.add(code)
+                for code in record.keys() & work_hoover.keys():
+                    field = work_hoover[code]
+                    if field in wk and wk[field] is None:
+                        wk[field] = record[code]
+                    if field in ed and ed[field] is None:
+                        ed[field] = record[code]
+                    else:
+                        unused_codes.add(code)
                 
-                # Set uuids
-                wk['uuid'] = str(uuid4())
-                ed['uuid'] = str(uuid4())
+                # Set uuids and primary keys
+                wk['uuid'] = next(uuids)
+                ed['uuid'] = next(uuids)
+                if work_identifier[0] not in known_works:
+                    known_works[work_identifier[0]] = next(work_ids)
+                wk['work_id'] = ed['work_id'] = known_works[work_identifier[0]]
+                ed['edition_id'] = edition_id = next(edition_ids)
 
                 # Set identifiers and edition counter
                 wk['work_identifier'] = ed['work_identifier'] = work_identifier[0]             
@@ -555,35 +835,27 @@ class mmfParser(object):
                 
                 # Unpack title. Work title is short title.
                 if wk['title'] is not None:
-                    title_parts = title_rgx.split(wk['title'])
-                    wk['title'] = title_parts[0]
-                    ed['long_title'] = ''.join(title_parts)
-                    ed['short_title'] = title_parts[0]
+                    title = wk['title']
+                    marker = _TITLE_RE.search(title)
+                    if marker is None:
+                        ed['long_title'] = ed['short_title'] = title
+                    else:
+                        # The long title is the whole title without its markers
+                        wk['title'] = ed['short_title'] = title[:marker.start()]
+                        ed['long_title'] = wk['title'] + _TITLE_RE.sub('', title[marker.end():])
                 elif ed['short_title'] is not None:
                     if ed['long_title'] is not None:
                         ed['long_title']
 
-                # Insert work
-                self.cur.execute(insert_work, wk)
-                self.conn.commit()
+                # Queue work and edition
+                enqueue('mmf_work', wk)
+                enqueue('mmf_edition', ed)
 
-                # Get primary key
-                self.cur.execute('SELECT LAST_INSERT_ID()')
-                ed['work_id'] = self.cur.fetchone()[0]
-
-                # Insert edition
-                self.cur.execute(insert_edition, ed)
-                self.conn.commit()
-
-                # Get new primary key
-                self.cur.execute('SELECT LAST_INSERT_ID()')
-                edition_id = self.cur.fetchone()[0]
-
-                # Explode holdings and insert them
+                # Explode holdings and queue them
                 # NB: above, holdings are seperated by commas, here by spaces
                 # Extract holdings using regex
                 if ed['holdings'] is not None:
-                    holdings = holding_rgx.findall(ed['holdings'])
+                    holdings = _HOLDING_RE.findall(ed['holdings'])
                     # If none are extracted, log an error
                     if len(holdings) == 0:
                         _log_error(
@@ -592,48 +864,36 @@ class mmfParser(object):
                             edition_id = edition_id
                             )
                     else:
-                        # Create parameter sequence
-                        param_seq = [(edition_id, lib)
-                                     for lib in holdings]
-                        # Insert the holdings
-                        self.cur.executemany(insert_holdings, param_seq)
-                        self.conn.commit()
+                        for lib in holdings:
+                            enqueue('mmf_holding', {'edition_id':edition_id, 'lib_name':lib})
                 
-                # Explode references and insert them
+                # Explode references and queue them
                 if wk['contemporary_references'] is not None:
                     # Explode into list
                     cr_list = wk['contemporary_references'].split('  ')
-                    # Format for insert
-                    cr_list = [{'work_id':ed['work_id'], 'short_name':x, 'page_num':None, 'ref_type':1} for x in cr_list]
-                    self.cur.executemany(insert_references, cr_list)
-                    self.conn.commit()
+                    for x in cr_list:
+                        enqueue('mmf_ref', {'work_id':ed['work_id'], 'short_name':x, 'page_num':None, 'ref_type':1})
                 
                 if wk['later_references'] is not None:
                     # Explode into list
                     lr_list = wk['later_references'].split('  ')
                     # Unpack using pagenum regex 
-                    lr_out = []
                     for ref in lr_list:
                         ref_dict = {'work_id':ed['work_id'], 'ref_type':2, 'page_num':None}
-                        # Use regex to strip page numbers
-                        ref_dict['short_name'] = pages_rgx.sub('', ref).strip()
-                        # Extract page numbers...
-                        pages = pages_rgx.findall(ref)
+                        # Split out page numbers in one pass: they are the
+                        # odd-numbered parts, and the short name the rest
+                        parts = _PAGES_RE.split(ref)
+                        ref_dict['short_name'] = ''.join(parts[::2]).strip()
+                        pages = parts[1::2]
                         # If there are any pages, create an entry for each paged reference
                         if len(pages) > 0:
                             for page in pages:
-                                # Create copy of dict
-                                ref_dict = ref_dict.copy()
                                 # Insert new page number
                                 ref_dict['page_num'] = page
-                                # Append to parameter list for insert query
-                                lr_out.append(ref_dict)
-                        # Otherwise just add the reference to the out_list
+                                enqueue('mmf_ref', ref_dict)
+                        # Otherwise just add the reference as it is
                         else:
-                            lr_out.append(ref_dict)
-                    
-                    self.cur.executemany(insert_references, lr_out)
-                    self.conn.commit()
+                            enqueue('mmf_ref', ref_dict)
 
                 successes += 1
 
@@ -651,23 +911,68 @@ class mmfParser(object):
                     error_note=f'Unused codes: {unused_codes}'
                 )
                 errors += 1
+                unused_codes.clear()
 
-            pbar.update(1)
-        
-        # Close the progress bar
-        pbar.close()
+        # Write out any remaining rows
+        self.flush()
+        self._close_prepared()
 
         # Rebuild the indexes
         print('Rebuilding indexes...')
-        for idx_dict in self.INDEXES:
-            self.cur.execute("CREATE INDEX {name} ON {table} ({column})".format(**idx_dict))
+        self._alter_indexes('ADD INDEX {name} ({column})', 'ALGORITHM=INPLACE, LOCK=NONE')
         self.conn.commit()
 
+        # Refresh index statistics, so the linking joins use the new indexes
+        self.cur.execute("ANALYZE TABLE mmf_work, mmf_edition, mmf_holding")
+        self.cur.fetchall()
+
         # Close the cursor
         self.cur.close()
 
         print(f'Database update complete. {successes} records inserted, with {errors} errors.')
 
+    def _run_sharded(self, stmt, table, key):
+        """Runs a statement over disjoint ranges of a table's primary key in parallel.
+        
+        The key range is split into SHARDS pieces, and each piece is run on
+        its own pooled connection.
+
+        Arguments:
+        ==========
+        stmt (str): SQL taking the first and last key of a range as parameters
+        table (str): the table whose key range is to be split
+        key (str): the primary key of the table
+
+        Returns:
+        ========
+        The total number of rows affected.
+        """
+
+        # Find the range of keys
+        with self._conn() as conn:
+            cur = conn.cursor()
+            cur.execute(f'SELECT MIN({key}), MAX({key}) FROM {table}')
+            first, last = cur.fetchone()
+            cur.close()
+        if first is None:
+            return 0
+
+        # Split it into shards
+        step = (last - first) // self.SHARDS + 1
+        shards = [(start, min(start + step - 1, last)) for start in range(first, last + 1, step)]
+
+        # Inner function for running a single shard
+        def _run_shard(shard):
+            with self._conn() as conn:
+                cur = conn.cursor()
+                cur.execute(stmt, shard)
+                rowcount = cur.rowcount
+                cur.close()
+            return rowcount
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            return sum(executor.map(_run_shard, shards))
+
     def link_books(self):
         """Attempts to link related records across the database.
         
@@ -676,39 +981,49 @@ class mmfParser(object):
         was to enable such cross-referencing."""
 
         # SQL statements
+        # Editions are grouped by identifier first, so that each new work is
+        # inserted once, and only then given a uuid
         new_work_stmt = """
-        INSERT INTO mmf_work (work_identifier, title, translation)
-            SELECT DISTINCT work_identifier, short_title, translation
-            FROM mmf_edition
-            WHERE mmf_edition.work_identifier NOT IN(SELECT work_identifier FROM mmf_work)
+        INSERT INTO mmf_work (uuid, work_identifier, title, translation)
+            SELECT UNHEX(REPLACE(UUID(), '-', '')), work_identifier, title, translation
+            FROM (
+                SELECT work_identifier, MIN(short_title) AS title, MIN(translation) AS translation
+                FROM mmf_edition
+                WHERE mmf_edition.work_identifier NOT IN(SELECT work_identifier FROM mmf_work)
+                GROUP BY work_identifier
+            ) AS new_work
         """
         link_book_stmt = """
         UPDATE mmf_edition AS e
         LEFT JOIN mmf_work AS w ON e.work_identifier = w.work_identifier
         SET e.work_id = w.work_id
         WHERE e.work_id IS NULL
+        AND e.edition_id BETWEEN %s AND %s
         """
 
         # Execute statement
-        self.cur = self.conn.cursor()
-        print("Creating missing works...")
-        self.cur.execute(new_work_stmt)
-        print(f'{self.cur.rowcount} works created.')
+        with self._conn() as conn:
+            cur = conn.cursor()
+            print("Creating missing works...")
+            cur.execute(new_work_stmt)
+            print(f'{cur.rowcount} works created.')
+            cur.close()
         print("Linking editions to works...")
-        self.cur.execute(link_book_stmt)
-        print(f'{self.cur.rowcount} links created.')
-        self.conn.commit()
-        self.cur.close()
+        links = self._run_sharded(link_book_stmt, 'mmf_edition', 'edition_id')
+        print(f'{links} links created.')
     
     def update_libraries(self):
         """Updates library table based on holdings."""
 
         # SQL to create new libraries
+        # Libraries that already exist are skipped, by the unique key where
+        # the table has one, and otherwise by the NOT EXISTS check
         new_lib_stmt = """
-        INSERT INTO mmf_lib (short_name)
-            SELECT DISTINCT mmf_holding.lib_name
-            FROM mmf_holding
-            WHERE mmf_holding.lib_name NOT IN(SELECT short_name FROM mmf_lib) 
+        INSERT IGNORE INTO mmf_lib (short_name)
+            SELECT DISTINCT h.lib_name
+            FROM mmf_holding AS h
+            WHERE h.lib_name IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM mmf_lib AS l WHERE l.short_name = h.lib_name)
         """
         # Update links to mmf_holding
         link_lib_stmt = """
@@ -716,110 +1031,109 @@ class mmfParser(object):
         LEFT JOIN mmf_lib AS l ON h.lib_name = l.short_name
         SET h.lib_id = l.lib_id
         WHERE h.lib_id IS NULL
+        AND h.holding_id BETWEEN %s AND %s
         """
 
         # Execute
-        self.cur = self.conn.cursor()
-        print("Updating library table...")
-        self.cur.execute(new_lib_stmt)
-        print(f'{self.cur.rowcount} new libraries added to mmf_lib.')
+        with self._conn() as conn:
+            cur = conn.cursor()
+            print("Updating library table...")
+            cur.execute(new_lib_stmt)
+            print(f'{cur.rowcount} new libraries added to mmf_lib.')
+            cur.close()
         print("Linking holdings to libraries...")
-        self.cur.execute(link_lib_stmt)
-        print(f'{self.cur.rowcount} links created between libraries and holdings')
-        self.conn.commit()
-        self.cur.close()
+        links = self._run_sharded(link_lib_stmt, 'mmf_holding', 'holding_id')
+        print(f'{links} links created between libraries and holdings')
 
     def deduplicate_books(self):
-        """Searches for duplicates in the works table, and merges them."""
-
-        # Extract duplicates from database
-        get_duplicates =  """
-        SELECT * FROM mmf_work AS mwa
-            WHERE EXISTS (
-                SELECT 1
-                FROM mmf_work AS mwb
-                WHERE mwa.work_identifier = mwb.work_identifier
-                AND mwa.work_id <> mwb.work_id
-                LIMIT 1
-            )
-            ORDER BY work_identifier, work_id
+        """Searches for duplicates in the works table, and merges them.
+        
+        Duplicates are merged as they are imported, so this is only a safety
+        net for databases created before mmf_work had a unique key."""
+
+        # Are there any duplicates?
+        count_duplicates = """
+        SELECT COUNT(*) - COUNT(DISTINCT work_identifier) FROM mmf_work
+            WHERE work_identifier IS NOT NULL
         """
-        # Update works with missing info from other entries
-        update_works = """
-        UPDATE mmf_work
-        SET work_id = %s,
-            uuid = %s,
-            work_identifier = %s,
-            translation = %s,
-            title = %s,
-            comments = %s,
-            bur_references = %s,
-            bur_comments = %s,
-            original_title = %s,
-            translation_comments = %s,
-            description = %s,
-            incipit = %s
-        WHERE work_id = %s
+
+        # Duplicate works are grouped by identifier, and each group is merged
+        # into the work with the lowest id. For each column, the merged work
+        # takes the first value in id order that is neither NULL nor '$'.
+        # Works without an identifier are never duplicates of each other.
+        groups = """
+        SELECT work_identifier, MIN(work_id) AS keep_id
+            FROM mmf_work
+            WHERE work_identifier IS NOT NULL
+            GROUP BY work_identifier
+            HAVING COUNT(*) > 1
         """
+        # Map the ids of the extraneous works to the ids they are merged into
+        map_duplicates = f"""
+        CREATE TEMPORARY TABLE dupe_work (PRIMARY KEY (work_id))
+        SELECT w.work_id, g.keep_id
+            FROM mmf_work AS w
+            JOIN ({groups}) AS g
+                ON w.work_identifier = g.work_identifier
+                AND w.work_id <> g.keep_id
+        """
+        # Update works with missing info from other entries. The derived
+        # table holds, for each column, the id of the work to take it from.
+        cols = [col for col in self.COLUMNS['mmf_work'] if col not in ('work_id', 'uuid', 'work_identifier')]
+        update_works = """
+        UPDATE mmf_work AS w
+        JOIN (
+            SELECT MIN(work_id) AS keep_id, {sources}
+                FROM mmf_work
+                WHERE work_identifier IS NOT NULL
+                GROUP BY work_identifier
+                HAVING COUNT(*) > 1
+            ) AS d ON w.work_id = d.keep_id
+        {joins}
+        SET {assignments}
+        """.format(
+            sources=', '.join(f"MIN(IF(NULLIF({col}, '$') IS NULL, NULL, work_id)) AS {col}" for col in cols),
+            joins='\n        '.join(f'LEFT JOIN mmf_work AS src_{col} ON src_{col}.work_id = d.{col}' for col in cols),
+            assignments=', '.join(f'w.{col} = src_{col}.{col}' for col in cols)
+        )
         # Amend foreign keys in edition table
         correct_book_links = """
-        UPDATE mmf_edition
-        SET work_id = %s
-        WHERE work_id = %s
+        UPDATE mmf_edition AS e
+        JOIN dupe_work AS d ON e.work_id = d.work_id
+        SET e.work_id = d.keep_id
         """
         # Amend foreign keys in refs table
         correct_ref_links = """
-        UPDATE mmf_ref
-        SET work_id = %s
-        WHERE work_id = %s
+        UPDATE mmf_ref AS r
+        JOIN dupe_work AS d ON r.work_id = d.work_id
+        SET r.work_id = d.keep_id
         """
         # Delete extraneous entries
         delete_books = """
-        DELETE FROM mmf_work
-        WHERE work_id = %s
+        DELETE w FROM mmf_work AS w
+        JOIN dupe_work AS d ON w.work_id = d.work_id
         """
 
-        self.cur = self.conn.cursor()
-        print(f'Removing duplicate works...')
-        self.cur.execute(get_duplicates)
-        # Get list of duplicates
-        duplicates = self.cur.fetchall()
-        # Convert to dict, with a list of lists for each identifier
-        duplicates_dict = {}
-        for record in duplicates:
-            ident = record[2]
-            if ident in duplicates_dict:
-                duplicates_dict[ident].append(record)
-            else:
-                duplicates_dict[ident] = [record]
-        # Deduplicate and retrieve id mappings
-        deduplicated = []
-        id_mappings = []
-        for records in duplicates_dict.values():
-            # Keep the first non-None value for each value
-            deduped_rec = [next((val for val in tup if val not in {None, '$'}), None)
-                           for tup in zip(*records)]
-            # Add work_id for where clause of update query
-            deduped_rec += [records[0][0]]
-            # Append to main list
-            deduplicated.append(deduped_rec)
-            # Record the work ids to delete/amend
-            # Each is a tuple of old_id, new_id:
-            mapped_rec = [(rec[0], records[0][0]) for rec in records[1:]]
-            id_mappings += mapped_rec
-        
-        print(f'Updating mmf_work...')
-        self.cur.executemany(update_works, deduplicated)
-        self.cur.executemany(delete_books, [(ids[0],) for ids in id_mappings])
-        print(f'{self.cur.rowcount} duplicate works deleted.')
-        self.conn.commit()
-        print(f'Updating links...')
-        self.cur.executemany(correct_book_links, id_mappings)
-        print(f'{self.cur.rowcount} links amended in mmf_edition.')
-        self.cur.executemany(correct_ref_links, id_mappings)
-        print(f'{self.cur.rowcount} links amended in mmf_ref.')
-        self.conn.commit()
-        self.cur.close()
+        with self._conn() as conn:
+            cur = conn.cursor()
+            cur.execute(count_duplicates)
+            if cur.fetchone()[0] == 0:
+                print('No duplicate works found.')
+                cur.close()
+                return
+            print(f'Removing duplicate works...')
+            cur.execute(map_duplicates)
+            print(f'Updating mmf_work...')
+            cur.execute(update_works)
+            cur.execute(delete_books)
+            print(f'{cur.rowcount} duplicate works deleted.')
+            print(f'Updating links...')
+            cur.execute(correct_book_links)
+            print(f'{cur.rowcount} links amended in mmf_edition.')
+            cur.execute(correct_ref_links)
+            print(f'{cur.rowcount} links amended in mmf_ref.')
+            cur.execute("DROP TEMPORARY TABLE dupe_work")
+            cur.close()
 
     def link_to_mpce(self, mpce_conn):
         """Tries to link all the editions in the MMF data to an MPCE edition.
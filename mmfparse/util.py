@@ -15,16 +15,20 @@ class DupeDict(dict):
 
 
     def __init__(self, *args, **kwargs):
+        # Last suffix used for each renamed key
+        self._counts = {}
         self.update(*args, **kwargs)
 
     def __setitem__(self, key, value):
         key = str(key)
-        i = 0
         if key in self:
-            i += 1
-            self.__setitem__(key + str(i), value)
-        else:
-            super(DupeDict, self).__setitem__(key, value)
+            # Carry on from the last suffix used, skipping any taken
+            i = self._counts.get(key, 0) + 1
+            while key + str(i) in self:
+                i += 1
+            self._counts[key] = i
+            key = key + str(i)
+        super(DupeDict, self).__setitem__(key, value)
 
     def update(self, *args, **kwargs):
         if args:
@@ -53,3 +57,37 @@ class ErrorDict(dict):
             text=None,
             error_note=None
         )
+
+def tsv_field(value):
+    """Formats a value as a field for LOAD DATA INFILE.
+
+    None becomes MySQL's NULL marker, bytes are written as hex (to be read
+    back with UNHEX), and backslashes, tabs and line breaks are escaped so
+    they cannot be mistaken for delimiters."""
+
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        return value.hex()
+    return (str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r'))
+
+def confirm(prompt):
+    """Asks the user a yes/no question until they give a valid answer.
+
+    Returns True for yes and False for no. If there is no more input to
+    read, the answer is taken to be no."""
+
+    while True:
+        try:
+            choice = input(prompt).strip().lower()
+        except EOFError:
+            return False
+        if choice in ('y', 'yes'):
+            return True
+        if choice in ('n', 'no'):
+            return False
+        print('Please answer y or n.')
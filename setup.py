@@ -14,6 +14,9 @@ setup(
     long_description = long_description,
     long_description_content_type = "text/markdown",
     entry_points = {
-        'console_scripts': ['parse-mmf=mmfparse.command:main']
+        'console_scripts': [
+            'mmfparse=mmfparse.cli:main',
+            'parse-mmf=mmfparse.command:main'
+        ]
     }
 )